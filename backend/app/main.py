@@ -2,6 +2,7 @@ import logging
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 
 from app.routes.invoice_routes import router as invoice_router
@@ -17,7 +18,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Invoice Data Extraction System",
     description="Extract data from PDF invoices using AI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
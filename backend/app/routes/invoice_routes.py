@@ -1,18 +1,36 @@
 import logging
 import os
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import uuid
+from functools import lru_cache
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi.responses import StreamingResponse
+import orjson
 from typing import List
 
 from app.services.invoice_service import InvoiceProcessingService
-from app.schemas import InvoiceProcessingResponse, ErrorResponse
+from app.schemas import (
+    INVOICE_LIST_ADAPTER,
+    InvoiceProcessingResponse,
+    BatchSubmitResponse,
+    BatchResultResponse,
+    ErrorResponse,
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/invoices", tags=["invoices"])
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
+
+@lru_cache(maxsize=1)
 def get_invoice_service() -> InvoiceProcessingService:
-    """Get invoice processing service with API key."""
+    """
+    Get the shared invoice processing service.
+
+    Cached so the OpenAI client's connection pool, the rate limiter and the
+    PDF worker pool are reused across requests.
+    """
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise HTTPException(
@@ -22,8 +40,45 @@ def get_invoice_service() -> InvoiceProcessingService:
     return InvoiceProcessingService(api_key)
 
 
-@router.post("/process", response_model=InvoiceProcessingResponse)
-async def process_invoices(files: List[UploadFile] = File(...)):
+async def save_uploaded_files(files: List[UploadFile], temp_file_paths: List[str]):
+    """
+    Save uploaded PDFs to the temp directory.
+
+    Args:
+        files: Uploaded files
+        temp_file_paths: List that each saved path is appended to, so callers
+            can clean up even if a later file is rejected
+    """
+    for file in files:
+        if not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(
+                status_code=400,
+                detail=f"File {file.filename} is not a PDF"
+            )
+
+        # Unique prefix: concurrent requests uploading the same filename
+        # would otherwise overwrite (and clean up) each other's input
+        temp_path = os.path.join(
+            "temp_uploads", f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}"
+        )
+        os.makedirs("temp_uploads", exist_ok=True)
+
+        with open(temp_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                f.write(chunk)
+
+        temp_file_paths.append(temp_path)
+
+
+@router.post(
+    "/process",
+    response_model=None,
+    responses={200: {"model": InvoiceProcessingResponse}}
+)
+async def process_invoices(
+    files: List[UploadFile] = File(...),
+    service: InvoiceProcessingService = Depends(get_invoice_service)
+):
     """
     Process PDF invoices and extract data.
 
@@ -34,36 +89,24 @@ async def process_invoices(files: List[UploadFile] = File(...)):
         raise HTTPException(status_code=400, detail="No files provided")
 
     temp_file_paths = []
-    service = None
 
     try:
-        service = get_invoice_service()
-
-        for file in files:
-            if not file.filename.lower().endswith('.pdf'):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File {file.filename} is not a PDF"
-                )
-
-            temp_path = f"temp_uploads/{file.filename}"
-            os.makedirs("temp_uploads", exist_ok=True)
+        await save_uploaded_files(files, temp_file_paths)
 
-            with open(temp_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
-
-            temp_file_paths.append(temp_path)
-
-        invoices, summary = service.process_invoices(temp_file_paths)
+        invoices, summary = await service.process_invoices(temp_file_paths)
         excel_path = service.generate_excel_export(invoices)
         excel_filename = os.path.basename(excel_path)
 
-        return InvoiceProcessingResponse(
-            invoices=invoices,
-            summary=summary,
-            excel_file_path=excel_filename
-        )
+        # Validate and dump the invoice list in one pass instead of letting
+        # FastAPI re-validate it field by field through response_model
+        return {
+            "invoices": INVOICE_LIST_ADAPTER.dump_python(
+                INVOICE_LIST_ADAPTER.validate_python(invoices),
+                mode='json'
+            ),
+            "summary": summary,
+            "excel_file_path": excel_filename
+        }
 
     except ValueError as e:
         logger.error(f"Validation error: {str(e)}")
@@ -75,9 +118,169 @@ async def process_invoices(files: List[UploadFile] = File(...)):
             detail=f"Error processing invoices: {str(e)}"
         )
     finally:
-        if service:
+        service.cleanup_temp_files(temp_file_paths)
+
+
+@router.post("/process-stream")
+async def process_invoices_stream(
+    files: List[UploadFile] = File(...),
+    service: InvoiceProcessingService = Depends(get_invoice_service)
+):
+    """
+    Process PDF invoices and stream results as Server-Sent Events.
+
+    Emits an "invoice" or "error" event as each file finishes, followed by
+    a final "complete" event carrying the summary and Excel export name.
+
+    Returns:
+        StreamingResponse with media type text/event-stream
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+
+    temp_file_paths = []
+
+    try:
+        await save_uploaded_files(files, temp_file_paths)
+    except Exception:
+        service.cleanup_temp_files(temp_file_paths)
+        raise
+
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+    async def event_stream():
+        invoices = []
+        errors = []
+        total_amount = 0.0
+        flagged_count = 0
+
+        try:
+            async for file_path, invoice, error in service.iter_process_invoices(temp_file_paths):
+                filename = service.display_name(file_path)
+                if error:
+                    errors.append(error)
+                    yield sse("error", {"file": filename, "error": error})
+                else:
+                    invoices.append(invoice)
+                    total_amount += float(invoice['total_amount'])
+                    flagged_count += invoice['flagged']
+                    yield sse("invoice", {"file": filename, "invoice": invoice})
+
+            if not invoices:
+                yield sse("complete", {
+                    "summary": None,
+                    "excel_file_path": None,
+                    "error": "No invoices could be processed from provided files"
+                })
+                return
+
+            summary = service.build_summary(len(invoices), total_amount, flagged_count, errors)
+            excel_path = service.generate_excel_export(invoices)
+
+            yield sse("complete", {
+                "summary": summary,
+                "excel_file_path": os.path.basename(excel_path)
+            })
+
+        except Exception as e:
+            logger.error(f"Error processing invoices: {str(e)}")
+            yield sse("complete", {
+                "summary": None,
+                "excel_file_path": None,
+                "error": f"Error processing invoices: {str(e)}"
+            })
+        finally:
             service.cleanup_temp_files(temp_file_paths)
 
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@router.post("/batch-submit", response_model=BatchSubmitResponse)
+async def submit_invoice_batch(
+    files: List[UploadFile] = File(...),
+    service: InvoiceProcessingService = Depends(get_invoice_service)
+):
+    """
+    Submit PDF invoices to the OpenAI Batch API for bulk processing.
+
+    Results are typically ready within minutes to hours (24h at most) and
+    are fetched from /batch-result/{batch_id}.
+
+    Returns:
+        BatchSubmitResponse with the batch ID
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+
+    temp_file_paths = []
+
+    try:
+        await save_uploaded_files(files, temp_file_paths)
+
+        batch_id, errors = await service.process_invoices_batch(temp_file_paths)
+
+        return BatchSubmitResponse(
+            batch_id=batch_id,
+            errors=errors if errors else None
+        )
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        logger.error(f"Validation error: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error submitting invoice batch: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error submitting invoice batch: {str(e)}"
+        )
+    finally:
+        service.cleanup_temp_files(temp_file_paths)
+
+
+@router.get("/batch-result/{batch_id}", response_model=BatchResultResponse)
+async def get_invoice_batch_result(
+    batch_id: str,
+    service: InvoiceProcessingService = Depends(get_invoice_service)
+):
+    """
+    Poll a submitted batch and return its invoices once completed.
+
+    Args:
+        batch_id: ID returned by /batch-submit
+
+    Returns:
+        BatchResultResponse with the batch status, plus extracted data,
+        summary and Excel export when the batch has completed
+    """
+    try:
+        status, invoices, summary = await service.get_batch_results(batch_id)
+    except Exception as e:
+        logger.error(f"Error retrieving invoice batch {batch_id}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error retrieving invoice batch: {str(e)}"
+        )
+
+    if status != "completed":
+        return BatchResultResponse(batch_id=batch_id, status=status)
+
+    excel_filename = None
+    if invoices:
+        # Keyed by batch so repeated polls reuse one export
+        excel_path = service.generate_excel_export(invoices, export_id=batch_id)
+        excel_filename = os.path.basename(excel_path)
+
+    return BatchResultResponse(
+        batch_id=batch_id,
+        status=status,
+        invoices=invoices,
+        summary=summary,
+        excel_file_path=excel_filename
+    )
+
 
 @router.get("/export/{filename}")
 async def download_export(filename: str):
@@ -94,13 +297,18 @@ async def download_export(filename: str):
 
     file_path = f"temp_uploads/{filename}"
 
-    if not os.path.exists(file_path):
+    # One stat both checks existence and spares FileResponse its own
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
 
+    # Exports stay downloadable until the service's TTL sweep removes them
     return FileResponse(
         file_path,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        filename=filename
+        filename=filename,
+        stat_result=stat_result
     )
 
 
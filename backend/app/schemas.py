@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 from typing import List, Optional
 from datetime import datetime
 
@@ -17,12 +17,48 @@ class ExtractedInvoice(BaseModel):
     flagged: bool = False
 
 
+# Built once at import; validates/serializes a whole invoice list in one call
+INVOICE_LIST_ADAPTER = TypeAdapter(List[ExtractedInvoice])
+
+
+class LineItemSchema(BaseModel):
+    """Line item shape requested from OpenAI structured outputs."""
+    model_config = ConfigDict(extra='forbid')
+
+    description: str
+    cost: float
+
+
+class InvoiceSchema(BaseModel):
+    """Invoice shape requested from OpenAI structured outputs."""
+    model_config = ConfigDict(extra='forbid')
+
+    vendor_name: str
+    invoice_number: str
+    invoice_date: str
+    total_amount: float
+    line_items: List[LineItemSchema]
+
+
 class InvoiceProcessingResponse(BaseModel):
     invoices: List[ExtractedInvoice]
     summary: dict
     excel_file_path: Optional[str] = None
 
 
+class BatchSubmitResponse(BaseModel):
+    batch_id: str
+    errors: Optional[List[str]] = None
+
+
+class BatchResultResponse(BaseModel):
+    batch_id: str
+    status: str
+    invoices: Optional[List[ExtractedInvoice]] = None
+    summary: Optional[dict] = None
+    excel_file_path: Optional[str] = None
+
+
 class ErrorResponse(BaseModel):
     error: str
     details: Optional[str] = None
@@ -1,32 +1,42 @@
+import asyncio
 import logging
 import os
-from typing import List, Dict, Tuple
-from datetime import datetime
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from pathlib import Path
 
-from app.utils.pdf_handler import extract_text_from_pdf, validate_pdf
+from app.utils.pdf_handler import extract_text_from_pdf
 from app.utils.openai_service import InvoiceExtractor
 from app.utils.excel_generator import ExcelGenerator
-from app.utils.currency import normalize_currency_data, get_multi_currency_summary
+from app.utils.currency import normalize_currency_data
 
 logger = logging.getLogger(__name__)
 
+# Uploads are saved as "<uuid4 hex>_<original name>"
+_UPLOAD_PREFIX = re.compile(r'^[0-9a-f]{32}_')
+
 
 class InvoiceProcessingService:
     """Service to handle invoice processing pipeline."""
 
     FLAGGED_AMOUNT_THRESHOLD = 5000.0
+    MAX_CONCURRENT_EXTRACTIONS = 10
+    EXPORT_TTL_SECONDS = int(os.getenv("EXPORT_TTL_SECONDS", "3600"))
 
     def __init__(self, api_key: str, temp_dir: str = "temp_uploads"):
         """Initialize the service."""
         self.extractor = InvoiceExtractor(api_key)
         self.excel_generator = ExcelGenerator()
+        self.pdf_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
         self.temp_dir = temp_dir
         Path(self.temp_dir).mkdir(exist_ok=True)
 
-    def process_invoices(self, pdf_file_paths: List[str]) -> Tuple[List[Dict], Dict]:
+    async def process_invoices(self, pdf_file_paths: List[str]) -> Tuple[List[Dict], Dict]:
         """
-        Process multiple PDF invoices and return extracted data with summary.
+        Process multiple PDF invoices concurrently and return extracted data with summary.
 
         Args:
             pdf_file_paths: List of paths to PDF files
@@ -37,29 +47,61 @@ class InvoiceProcessingService:
         Raises:
             ValueError: If no valid PDFs provided
         """
-        invoices = []
+        results = {}
         errors = []
+        total_amount = 0.0
+        flagged_count = 0
 
-        for file_path in pdf_file_paths:
-            try:
-                logger.info(f"Starting to process invoice: {file_path}")
-                invoice = self._process_single_invoice(file_path)
-                logger.info(f"Successfully processed: {file_path}")
-                invoices.append(invoice)
-            except Exception as e:
-                error_msg = f"Error processing {os.path.basename(file_path)}: {str(e)}"
-                logger.error(error_msg, exc_info=True)
-                errors.append(error_msg)
+        async for file_path, invoice, error in self.iter_process_invoices(pdf_file_paths):
+            if error:
+                errors.append(error)
+            else:
+                results[file_path] = invoice
+                total_amount += float(invoice['total_amount'])
+                flagged_count += invoice['flagged']
 
-        if not invoices:
+        if not results:
             raise ValueError("No invoices could be processed from provided files")
 
-        summary = self.excel_generator.get_summary_data(invoices)
-        summary['errors'] = errors if errors else None
+        # Report invoices in upload order rather than completion order
+        invoices = [results[p] for p in pdf_file_paths if p in results]
+        summary = self.build_summary(len(invoices), total_amount, flagged_count, errors)
 
         return invoices, summary
 
-    def _process_single_invoice(self, pdf_path: str) -> Dict:
+    async def iter_process_invoices(
+        self, pdf_file_paths: List[str]
+    ) -> AsyncIterator[Tuple[str, Optional[Dict], Optional[str]]]:
+        """
+        Process PDF invoices concurrently, yielding each one as it completes.
+
+        Args:
+            pdf_file_paths: List of paths to PDF files
+
+        Yields:
+            Tuples of (file path, invoice dict or None, error message or None)
+        """
+        sem = asyncio.Semaphore(self.MAX_CONCURRENT_EXTRACTIONS)
+
+        async def _bounded(file_path: str) -> Tuple[str, Optional[Dict], Optional[str]]:
+            async with sem:
+                try:
+                    return file_path, await self._process_single_invoice_async(file_path), None
+                except Exception as e:
+                    error_msg = f"Error processing {self.display_name(file_path)}: {str(e)}"
+                    logger.error(error_msg, exc_info=True)
+                    return file_path, None, error_msg
+
+        tasks = [asyncio.ensure_future(_bounded(p)) for p in pdf_file_paths]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Stop outstanding work if the consumer goes away early
+            for task in tasks:
+                task.cancel()
+
+    async def _process_single_invoice_async(self, pdf_path: str) -> Dict:
         """
         Process a single PDF invoice.
 
@@ -72,15 +114,121 @@ class InvoiceProcessingService:
         Raises:
             Exception: If processing fails
         """
-        if not validate_pdf(pdf_path):
-            raise ValueError(f"Invalid PDF file: {pdf_path}")
+        logger.info(f"Starting to process invoice: {pdf_path}")
+
+        pdf_text = await self._read_pdf_text(pdf_path)
+        invoice_data = await self.extractor.extract_invoice_data(pdf_text)
+        invoice_data = self._finalize_invoice(invoice_data)
+
+        logger.info(f"Successfully processed: {pdf_path}")
+        return invoice_data
+
+    async def process_invoices_batch(self, pdf_file_paths: List[str]) -> Tuple[str, List[str]]:
+        """
+        Submit PDF invoices to the OpenAI Batch API for non-interactive processing.
+
+        Args:
+            pdf_file_paths: List of paths to PDF files
+
+        Returns:
+            Tuple of (batch ID, list of per-file error messages)
+
+        Raises:
+            ValueError: If no valid PDFs provided
+        """
+        results = await asyncio.gather(
+            *[self._read_pdf_text(p) for p in pdf_file_paths],
+            return_exceptions=True
+        )
+
+        pdf_texts = {}
+        errors = []
+
+        for file_path, result in zip(pdf_file_paths, results):
+            if isinstance(result, Exception):
+                error_msg = f"Error processing {self.display_name(file_path)}: {str(result)}"
+                logger.error(error_msg, exc_info=result)
+                errors.append(error_msg)
+            else:
+                # The unique temp name, so same-named uploads stay separate
+                pdf_texts[os.path.basename(file_path)] = result
+
+        if not pdf_texts:
+            raise ValueError("No invoices could be processed from provided files")
+
+        batch_id = await self.extractor.submit_batch(pdf_texts)
+        return batch_id, errors
+
+    async def get_batch_results(self, batch_id: str) -> Tuple[str, List[Dict], Dict]:
+        """
+        Fetch the results of a submitted batch.
 
-        pdf_text = extract_text_from_pdf(pdf_path)
+        Args:
+            batch_id: ID returned by process_invoices_batch
+
+        Returns:
+            Tuple of (batch status, invoices list, summary dict); invoices and
+            summary are empty until the batch has completed
+        """
+        status, results, batch_errors = await self.extractor.retrieve_batch(batch_id)
+        if status != "completed":
+            return status, [], {}
+
+        errors = [
+            f"Error processing {self.display_name(custom_id)}: {message}"
+            for custom_id, message in batch_errors.items()
+        ]
+
+        invoices = []
+        total_amount = 0.0
+        flagged_count = 0
 
-        if not pdf_text.strip():
+        for invoice_data in results.values():
+            invoice = self._finalize_invoice(invoice_data)
+            invoices.append(invoice)
+            total_amount += float(invoice['total_amount'])
+            flagged_count += invoice['flagged']
+
+        summary = self.build_summary(len(invoices), total_amount, flagged_count, errors)
+
+        return status, invoices, summary
+
+    @staticmethod
+    def display_name(file_path: str) -> str:
+        """Original upload filename for a temp path, for messages and results."""
+        return _UPLOAD_PREFIX.sub('', os.path.basename(file_path))
+
+    @staticmethod
+    def build_summary(
+        invoice_count: int,
+        total_amount: float,
+        flagged_count: int,
+        errors: List[str]
+    ) -> Dict:
+        """Build the summary dict from totals accumulated while processing."""
+        return {
+            "total_invoices_processed": invoice_count,
+            "total_amount": round(total_amount, 2),
+            "flagged_invoices_count": flagged_count,
+            "errors": errors if errors else None
+        }
+
+    async def _read_pdf_text(self, pdf_path: str) -> str:
+        """
+        Extract a PDF's text on the PDF worker pool.
+
+        Validation happens in the same pass; invalid files raise InvalidPDFError.
+        """
+        loop = asyncio.get_running_loop()
+        pdf_text = await loop.run_in_executor(self.pdf_pool, extract_text_from_pdf, pdf_path)
+
+        if not pdf_text or pdf_text.isspace():
             raise ValueError("Could not extract readable text from PDF")
 
-        invoice_data = self.extractor.extract_invoice_data(pdf_text)
+        return pdf_text
+
+    def _finalize_invoice(self, invoice_data: Dict) -> Dict:
+        """Normalize currency data and flag high-value invoices."""
         invoice_data = normalize_currency_data(invoice_data)
 
         comparison_amount = float(invoice_data.get('total_amount_usd', invoice_data.get('total_amount', 0)))
@@ -88,23 +236,46 @@ class InvoiceProcessingService:
 
         return invoice_data
 
-    def generate_excel_export(self, invoices: List[Dict]) -> str:
+    def generate_excel_export(self, invoices: List[Dict], export_id: Optional[str] = None) -> str:
         """
         Generate Excel file from invoices.
 
         Args:
             invoices: List of invoice dictionaries
+            export_id: Stable name for the export (e.g. a batch ID); an
+                existing export with the same ID is reused, not rewritten
 
         Returns:
             Path to generated Excel file
         """
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"invoices_export_{timestamp}.xlsx"
-        output_path = os.path.join(self.temp_dir, output_filename)
+        self.cleanup_expired_exports()
+
+        if export_id is not None:
+            output_path = os.path.join(self.temp_dir, f"invoices_export_{export_id}.xlsx")
+            if os.path.exists(output_path):
+                return output_path
+        else:
+            # Random suffix: concurrent requests finishing in the same second
+            # would collide on a timestamp and overwrite each other's export
+            output_filename = f"invoices_export_{uuid.uuid4().hex[:12]}.xlsx"
+            output_path = os.path.join(self.temp_dir, output_filename)
 
         self.excel_generator.generate_invoice_report(invoices, output_path)
         return output_path
 
+    def cleanup_expired_exports(self):
+        """Delete Excel exports older than EXPORT_TTL_SECONDS."""
+        cutoff = time.time() - self.EXPORT_TTL_SECONDS
+        for export_path in Path(self.temp_dir).glob("invoices_export_*.xlsx"):
+            try:
+                if export_path.stat().st_mtime < cutoff:
+                    export_path.unlink()
+                    logger.info(f"Deleted expired export: {export_path}")
+            except FileNotFoundError:
+                pass  # Removed by a concurrent sweep
+            except Exception as e:
+                logger.warning(f"Could not delete export {export_path}: {str(e)}")
+
     def cleanup_temp_files(self, file_paths: List[str]):
         """Clean up temporary uploaded files."""
         for file_path in file_paths:
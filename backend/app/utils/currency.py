@@ -5,27 +5,30 @@ Supports major currencies: USD, EUR, GBP, JPY, CAD, AUD, CHF, CNY, INR, etc.
 """
 
 import re
-from typing import Dict, Tuple, Optional
+from typing import Dict, Iterable, Tuple, Optional
 import logging
 
+import ahocorasick
+
 logger = logging.getLogger(__name__)
 
-CURRENCY_SYMBOLS = {
-    '$': 'USD',
-    '€': 'EUR',
-    '£': 'GBP',
-    '¥': 'JPY',
-    '₹': 'INR',
-    'C$': 'CAD',
-    'A$': 'AUD',
-    'NZ$': 'NZD',
-    'kr': 'SEK',
-    'CHF': 'CHF',
-    'R$': 'BRL',
-    '₽': 'RUB',
-    'R': 'ZAR',
-    'kr': 'NOK',
-}
+# (symbol, currency_code) pairs with unique symbols. "kr" is shared by NOK
+# and SEK, so it maps to None and is resolved from context.
+CURRENCY_SYMBOLS = (
+    ('$', 'USD'),
+    ('€', 'EUR'),
+    ('£', 'GBP'),
+    ('¥', 'JPY'),
+    ('₹', 'INR'),
+    ('C$', 'CAD'),
+    ('A$', 'AUD'),
+    ('NZ$', 'NZD'),
+    ('kr', None),
+    ('CHF', 'CHF'),
+    ('R$', 'BRL'),
+    ('₽', 'RUB'),
+    ('R', 'ZAR'),
+)
 
 CURRENCY_NAMES = {
     'dollar': 'USD',
@@ -89,6 +92,95 @@ CURRENCY_PATTERNS = [
     (r'NZD|New Zealand', 'NZD'),
 ]
 
+# Single-pass matcher: one alternation with a named group per currency code.
+# Matches are ranked by CURRENCY_PATTERNS order, not position in the text,
+# so e.g. any "$100" still means USD even after "Academy" (CAD) or "Audit" (AUD).
+_COMBINED_PATTERN = re.compile(
+    "|".join(f"(?P<{code}>{pattern})" for pattern, code in CURRENCY_PATTERNS),
+    re.IGNORECASE
+)
+_PATTERN_PRIORITY = {code: index for index, (_, code) in enumerate(CURRENCY_PATTERNS)}
+
+
+# Explicit NOK/SEK codes are caught by _COMBINED_PATTERN, so a bare "kr" is
+# resolved from the VAT abbreviation or country named on the invoice.
+_KRONA_CONTEXT = re.compile(
+    r'\b(?:(mva|norge|norway)|(moms|sverige|sweden))\b',
+    re.IGNORECASE
+)
+
+
+def _build_automaton(keywords: Iterable[Tuple[str, Optional[str]]]) -> ahocorasick.Automaton:
+    """
+    Build an Aho-Corasick automaton mapping each keyword to its currency code.
+
+    Each keyword also carries its position in the table, which ranks matches.
+    """
+    automaton = ahocorasick.Automaton()
+    for priority, (keyword, currency_code) in enumerate(keywords):
+        automaton.add_word(keyword, (priority, keyword, currency_code))
+    automaton.make_automaton()
+    return automaton
+
+
+# Names are matched against lowercased text, symbols case-sensitively.
+_NAME_AUTOMATON = _build_automaton(CURRENCY_NAMES.items())
+_SYMBOL_AUTOMATON = _build_automaton(CURRENCY_SYMBOLS)
+
+
+def _resolve_krona(text: str) -> Optional[str]:
+    """Tell NOK from SEK for a bare "kr" symbol, or None if undecidable."""
+    match = _KRONA_CONTEXT.search(text)
+    if not match:
+        return None
+    return 'NOK' if match.group(1) else 'SEK'
+
+
+def _find_pattern(text: str) -> Optional[re.Match]:
+    """Scan text once and return the match whose pattern comes first in CURRENCY_PATTERNS."""
+    best = None
+    for match in _COMBINED_PATTERN.finditer(text):
+        if best is None or _PATTERN_PRIORITY[match.lastgroup] < _PATTERN_PRIORITY[best.lastgroup]:
+            best = match
+            if _PATTERN_PRIORITY[best.lastgroup] == 0:
+                break
+    return best
+
+
+def _find_keyword(
+    automaton: ahocorasick.Automaton,
+    text: str,
+    whole_word: bool
+) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    Scan text once and return the (keyword, currency_code) listed first in its table.
+
+    Alphabetic keywords must start a word, and with whole_word also end one,
+    so "cad" doesn't match inside "academy" nor "R" inside "Receipt".
+    Keywords nested inside a longer match lose to it, so "canadian dollar"
+    is not "dollar" and "NZ$" is not "$".
+    """
+    hits = []
+    for end, (priority, keyword, currency_code) in automaton.iter(text):
+        start = end - len(keyword) + 1
+        if keyword[0].isalpha() and start > 0 and text[start - 1].isalpha():
+            continue
+        if whole_word and keyword[-1].isalpha() and end + 1 < len(text) and text[end + 1].isalpha():
+            continue
+        hits.append((priority, start, end, keyword, currency_code))
+
+    spans = [(start, end) for _, start, end, keyword, _ in hits if len(keyword) > 1]
+    best = None
+    for hit in hits:
+        priority, start, end = hit[:3]
+        nested = any(
+            outer_start <= start and end <= outer_end and outer_end - outer_start > end - start
+            for outer_start, outer_end in spans
+        )
+        if not nested and (best is None or priority < best[0]):
+            best = hit
+    return best[3:] if best else None
+
 
 def detect_currency(text: str) -> Tuple[str, float]:
     """
@@ -100,26 +192,42 @@ def detect_currency(text: str) -> Tuple[str, float]:
     Returns:
         Tuple of (currency_code, confidence_score)
         confidence_score: 0-1 indicating how confident the detection is
+
+    Examples:
+        >>> detect_currency("Academy Services Inc\\nTotal: $500.00")
+        ('USD', 0.9)
+        >>> detect_currency("Audit services rendered\\nTotal: $1,200.00")
+        ('USD', 0.9)
+        >>> detect_currency("Rubber gaskets x10  $40.00")
+        ('USD', 0.9)
+        >>> detect_currency("Receipt #12\\nTotal: $ 500.00")
+        ('USD', 0.88)
     """
     if not text:
         return 'USD', 0.5
 
-    text_lower = text.lower()
-
-    for pattern, currency_code in CURRENCY_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            logger.info(f"Detected currency: {currency_code} using pattern {pattern}")
-            return currency_code, 0.9
-
-    for name, currency_code in CURRENCY_NAMES.items():
-        if name in text_lower:
-            logger.info(f"Detected currency: {currency_code} by name match")
-            return currency_code, 0.85
-
-    for symbol, currency_code in CURRENCY_SYMBOLS.items():
-        if symbol in text:
+    match = _find_pattern(text)
+    if match:
+        currency_code = match.lastgroup
+        logger.info(f"Detected currency: {currency_code} using pattern match '{match.group(0)}'")
+        return currency_code, 0.9
+
+    # Names may run on ("dollars", "euros"); symbols must stand alone
+    match = _find_keyword(_NAME_AUTOMATON, text.lower(), whole_word=False)
+    if match:
+        currency_code = match[1]
+        logger.info(f"Detected currency: {currency_code} by name match")
+        return currency_code, 0.85
+
+    match = _find_keyword(_SYMBOL_AUTOMATON, text, whole_word=True)
+    if match:
+        symbol, currency_code = match
+        if currency_code is None:
+            currency_code = _resolve_krona(text)
+        if currency_code:
             logger.info(f"Detected currency: {currency_code} by symbol")
             return currency_code, 0.88
+        logger.warning(f"Ambiguous currency symbol '{symbol}' without context")
 
     logger.warning("No currency detected, defaulting to USD")
     return 'USD', 0.5
@@ -273,22 +381,24 @@ def normalize_currency_data(invoice_data: Dict) -> Dict:
     invoice_data['currency_confidence'] = confidence
     invoice_data['currency_symbol'] = get_currency_symbol(detected_currency)
 
+    # Loop-invariant: look the rate up once instead of per amount
+    from_rate = EXCHANGE_RATES.get(detected_currency)
+    if from_rate is None:
+        logger.warning(f"Exchange rate not found for {detected_currency}, keeping original amounts")
+    to_usd = 1.0 / from_rate if from_rate else 1.0
+
     if 'total_amount' in invoice_data:
         invoice_data['total_amount_formatted'] = format_currency(
             invoice_data['total_amount'],
             detected_currency
         )
-        invoice_data['total_amount_usd'] = convert_currency(
-            invoice_data['total_amount'],
-            detected_currency,
-            'USD'
-        )
+        invoice_data['total_amount_usd'] = round(invoice_data['total_amount'] * to_usd, 2)
 
     if 'line_items' in invoice_data:
         for item in invoice_data['line_items']:
             if 'cost' in item:
                 item['cost_formatted'] = format_currency(item['cost'], detected_currency)
-                item['cost_usd'] = convert_currency(item['cost'], detected_currency, 'USD')
+                item['cost_usd'] = round(item['cost'] * to_usd, 2)
 
     return invoice_data
 
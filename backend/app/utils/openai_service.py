@@ -1,19 +1,107 @@
-import json
+import asyncio
 import logging
-from typing import Dict, List
-from openai import OpenAI
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from openai import AsyncOpenAI, RateLimitError
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+import orjson
+import tiktoken
 import os
 
+from app.schemas import InvoiceSchema
+
 logger = logging.getLogger(__name__)
 
+INVOICE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "invoice",
+        "schema": InvoiceSchema.model_json_schema(),
+        "strict": True
+    }
+}
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """Load the tiktoken encoding for a model once, or None if it is unavailable."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding for {model}, estimating tokens from length: {str(e)}")
+        return None
+
+
+class RateLimiter:
+    """
+    Proactive request/token bucket throttle for OpenAI API calls.
+
+    Capacity refills continuously at max_requests_per_minute / 60 and
+    max_tokens_per_minute / 60 per second, so concurrent callers wait here
+    instead of hitting 429 responses.
+    """
+
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self._last_update = time.monotonic()
+
+    def _refill(self):
+        """Add the capacity accrued since the last update."""
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self.available_request_capacity = min(
+            self.max_requests_per_minute,
+            self.available_request_capacity + self.max_requests_per_minute * elapsed / 60.0
+        )
+        self.available_token_capacity = min(
+            self.max_tokens_per_minute,
+            self.available_token_capacity + self.max_tokens_per_minute * elapsed / 60.0
+        )
+        self._last_update = now
+
+    async def acquire(self, estimated_tokens: int):
+        """
+        Wait until there is capacity for one request of the given token size.
+
+        Args:
+            estimated_tokens: Prompt tokens plus the maximum completion tokens
+        """
+        estimated_tokens = min(estimated_tokens, self.max_tokens_per_minute)
+        while True:
+            self._refill()
+            if (self.available_request_capacity >= 1
+                    and self.available_token_capacity >= estimated_tokens):
+                self.available_request_capacity -= 1
+                self.available_token_capacity -= estimated_tokens
+                return
+            await asyncio.sleep(0.05)
+
 
 class InvoiceExtractor:
+    MAX_TOKENS = 1200
+    MAX_ATTEMPTS = 6
+    # Long PDFs keep their head (vendor, number, date) and tail (totals)
+    MAX_PDF_TEXT_TOKENS = 8000
+    PDF_TEXT_HEAD_TOKENS = 6000
+    PDF_TEXT_TAIL_TOKENS = 2000
+
     def __init__(self, api_key: str):
         """Initialize OpenAI client with API key."""
-        self.client = OpenAI(api_key=api_key)
-        self.model = "gpt-4"
+        self.client = AsyncOpenAI(api_key=api_key)
+        self.model = "gpt-4o-mini"
+        self.rate_limiter = RateLimiter(
+            max_requests_per_minute=float(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", "500")),
+            max_tokens_per_minute=float(os.getenv("OPENAI_MAX_TOKENS_PER_MINUTE", "200000"))
+        )
 
-    def extract_invoice_data(self, pdf_text: str) -> Dict:
+    async def extract_invoice_data(self, pdf_text: str) -> Dict:
         """
         Extract structured invoice data from PDF text using OpenAI.
 
@@ -28,24 +116,22 @@ class InvoiceExtractor:
         """
         try:
             logger.info(f"Starting OpenAI extraction with model: {self.model}")
-            prompt = self._create_extraction_prompt(pdf_text)
+            # Tokenizing a long invoice is CPU-bound; keep it off the event loop
+            loop = asyncio.get_running_loop()
+            body, estimated_tokens = await loop.run_in_executor(
+                None, self._prepare_request, pdf_text
+            )
             logger.info(f"Prompt created with {len(pdf_text)} characters of PDF text")
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert at extracting structured data from invoices. Extract the requested information and return valid JSON."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,
-                max_tokens=4000
-            )
+            async for attempt in AsyncRetrying(
+                wait=wait_random_exponential(min=1, max=60),
+                stop=stop_after_attempt(self.MAX_ATTEMPTS),
+                retry=retry_if_exception_type(RateLimitError),
+                reraise=True
+            ):
+                with attempt:
+                    await self.rate_limiter.acquire(estimated_tokens)
+                    response = await self.client.chat.completions.create(**body)
 
             logger.info("OpenAI API call successful")
             response_text = response.choices[0].message.content
@@ -59,8 +145,136 @@ class InvoiceExtractor:
             logger.error(f"Error extracting invoice data: {str(e)}", exc_info=True)
             raise
 
+    async def submit_batch(self, pdf_texts: Dict[str, str]) -> str:
+        """
+        Submit extraction requests to the OpenAI Batch API.
+
+        Args:
+            pdf_texts: Mapping of custom_id (unique per request) to extracted PDF text
+
+        Returns:
+            ID of the created batch
+        """
+        loop = asyncio.get_running_loop()
+        lines = await loop.run_in_executor(None, self._build_batch_lines, pdf_texts)
+        batch_input = await self.client.files.create(
+            file=("invoice_batch.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_input.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info(f"Submitted batch {batch.id} with {len(lines)} requests")
+        return batch.id
+
+    async def retrieve_batch(self, batch_id: str) -> Tuple[str, Dict[str, Dict], Dict[str, str]]:
+        """
+        Poll a batch and, once completed, parse its results.
+
+        Args:
+            batch_id: ID returned by submit_batch
+
+        Returns:
+            Tuple of (batch status, invoice data keyed by custom_id, error
+            messages keyed by custom_id)
+        """
+        batch = await self.client.batches.retrieve(batch_id)
+        results = {}
+        errors = {}
+
+        if batch.status != "completed":
+            return batch.status, results, errors
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                record = orjson.loads(line)
+                custom_id = record.get("custom_id")
+                response = record.get("response") or {}
+                try:
+                    if record.get("error") or response.get("status_code") != 200:
+                        error = record.get("error") or response.get("body", {}).get("error")
+                        raise ValueError(f"Batch request failed: {error}")
+                    response_text = response["body"]["choices"][0]["message"]["content"]
+                    results[custom_id] = self._parse_response(response_text)
+                except Exception as e:
+                    errors[custom_id] = str(e)
+
+        return batch.status, results, errors
+
+    def _build_batch_lines(self, pdf_texts: Dict[str, str]) -> List[bytes]:
+        """Serialize one Batch API request line per PDF text."""
+        return [
+            orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._build_request_body(pdf_text)
+            })
+            for custom_id, pdf_text in pdf_texts.items()
+        ]
+
+    def _prepare_request(self, pdf_text: str) -> Tuple[Dict, int]:
+        """Build the request body and estimate its token cost for the rate limiter."""
+        body = self._build_request_body(pdf_text)
+        estimated_tokens = sum(self._count_tokens(m["content"]) for m in body["messages"]) + self.MAX_TOKENS
+        return body, estimated_tokens
+
+    def _build_request_body(self, pdf_text: str) -> Dict:
+        """Build the chat completion request body for a PDF's text."""
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are an expert at extracting structured data from invoices. Extract the requested information and return valid JSON."
+                },
+                {
+                    "role": "user",
+                    "content": self._create_extraction_prompt(pdf_text)
+                }
+            ],
+            "temperature": 0.3,
+            "max_tokens": self.MAX_TOKENS,
+            "response_format": INVOICE_RESPONSE_FORMAT
+        }
+
+    def _count_tokens(self, text: str) -> int:
+        """Count the tokens in text for the configured model."""
+        encoding = _get_encoding(self.model)
+        if encoding is None:
+            return len(text) // 4
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def _truncate_pdf_text(self, pdf_text: str) -> str:
+        """Trim PDF text longer than MAX_PDF_TEXT_TOKENS to its head and tail."""
+        encoding = _get_encoding(self.model)
+
+        if encoding is None:
+            # Same budget at roughly 4 characters per token
+            if len(pdf_text) <= self.MAX_PDF_TEXT_TOKENS * 4:
+                return pdf_text
+            head = pdf_text[:self.PDF_TEXT_HEAD_TOKENS * 4]
+            tail = pdf_text[-self.PDF_TEXT_TAIL_TOKENS * 4:]
+        else:
+            ids = encoding.encode(pdf_text, disallowed_special=())
+            if len(ids) <= self.MAX_PDF_TEXT_TOKENS:
+                return pdf_text
+            head = encoding.decode(ids[:self.PDF_TEXT_HEAD_TOKENS])
+            tail = encoding.decode(ids[-self.PDF_TEXT_TAIL_TOKENS:])
+
+        logger.info(f"Truncated PDF text of {len(pdf_text)} characters to fit the prompt budget")
+        return f"{head}\n...\n{tail}"
+
     def _create_extraction_prompt(self, pdf_text: str) -> str:
         """Create the prompt for invoice data extraction."""
+        pdf_text = self._truncate_pdf_text(pdf_text)
         return f"""Extract the following information from this invoice text and return ONLY a valid JSON object with this exact structure:
 {{
     "vendor_name": "Company or vendor name",
@@ -88,17 +302,9 @@ Invoice text:
 {pdf_text}"""
 
     def _parse_response(self, response_text: str) -> Dict:
-        """Parse the OpenAI response and extract JSON data."""
+        """Parse the structured-output JSON response into invoice data."""
         try:
-            # Try to find JSON in the response
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-
-            if json_start == -1 or json_end == 0:
-                raise ValueError("No JSON found in response")
-
-            json_str = response_text[json_start:json_end]
-            data = json.loads(json_str)
+            data = orjson.loads(response_text)
 
             # Validate and clean data
             data['vendor_name'] = str(data.get('vendor_name', '')).strip()
@@ -130,7 +336,7 @@ Invoice text:
 
             return data
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Error parsing JSON response: {str(e)}")
             raise ValueError(f"Failed to parse invoice data: {str(e)}")
         except Exception as e: